@@ -1,3 +1,4 @@
 from . import lp
+from . import lp_store as store
 from . import lp_utils as utils
 from .lp_types import *
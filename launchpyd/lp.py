@@ -1,3 +1,4 @@
+import dataclasses
 import os
 import pickle
 import re
@@ -9,6 +10,12 @@ from pprint import pprint
 from launchpadlib.launchpad import Launchpad
 from tqdm import tqdm
 
+from launchpyd.lp_store import (
+    load_original_file_contents,
+    load_preview_diff_content,
+    save_original_file_contents,
+    save_preview_diff_content,
+)
 from launchpyd.lp_types import *
 from launchpyd.lp_utils import *
 
@@ -86,22 +93,49 @@ def get_lp_mp_obj_from_url(url):
     return None
 
 
-def get_all_diff_per_file_info(lp_mp_obj, lp_diff_obj, diff_text) -> list[DiffPerFileInfoType]:
+def get_original_file_contents_for_snippets(
+    lp_mp_obj,
+    target_revision_id: str,
+    diff_text_splits: dict[str, str],
+    file_retrieval_options: FileRetrievalOptionsType = None,
+) -> dict[str, str]:
+    """
+    Get the original contents of every file touched by the diff, given each file's diff text snippet
+    """
+    return get_file_contents_from_git_url_and_hash(
+        target_git_url=construct_git_ssh_url(lp_mp_obj.target_git_repository_link),
+        target_branch=lp_mp_obj.target_git_path.split("/")[-1],
+        target_hash=target_revision_id,
+        relevant_files=[filepath for filepath in diff_text_splits.keys()],
+        file_retrieval_options=file_retrieval_options,
+        hunk_ranges={filepath: parse_original_hunk_ranges(split) for filepath, split in diff_text_splits.items()},
+    )
+
+
+def get_diff_text_splits(diff_text: str) -> dict[str, str]:
+    """
+    Returns the diff text snippet of every file in the diff, keyed by file path
+    """
+    diff_text_splits = {}
+
+    for split in diff_text.split("diff --git")[1:]:
+        split = "diff --git" + split
+        filename_matches = re.findall(r"diff --git a/(.*) b/(.*)", split)[0]
+        diff_text_splits[filename_matches[0]] = split
+
+    return diff_text_splits
+
+
+def get_all_diff_per_file_info(
+    lp_mp_obj, lp_diff_obj, diff_text, file_retrieval_options: FileRetrievalOptionsType = None
+) -> list[DiffPerFileInfoType]:
     try:
         target_revision_id = lp_diff_obj.target_revision_id
 
-        diff_text_splits = {}
+        diff_text_splits = get_diff_text_splits(diff_text)
 
-        for split in diff_text.split("diff --git")[1:]:
-            split = "diff --git" + split
-            filename_matches = re.findall(r"diff --git a/(.*) b/(.*)", split)[0]
-            diff_text_splits[filename_matches[0]] = split
-
-        original_file_contents = get_file_contents_from_git_url_and_hash(
-            target_git_url=construct_git_ssh_url(lp_mp_obj.target_git_repository_link),
-            target_branch=lp_mp_obj.target_git_path.split("/")[-1],
-            target_hash=lp_diff_obj.target_revision_id,
-            relevant_files=[filepath for filepath in diff_text_splits.keys()],
+        original_file_contents = get_original_file_contents_for_snippets(
+            lp_mp_obj, target_revision_id, diff_text_splits, file_retrieval_options=file_retrieval_options
         )
 
         per_file_info_list = parse_base_diff_per_file_info(diff_text=diff_text)
@@ -130,8 +164,7 @@ def convert_inline_comments_dict_to_type(inline_comment: dict):
     )
 
 
-def get_diff_inline_comments_and_text_for_mp_and_diff(mp_obj, diff_obj):
-    preview_diff_id = diff_obj.id
+def get_simplified_inline_comments_for_mp_and_diff(mp_obj, preview_diff_id) -> list[dict]:
     inline_comments = mp_obj.getInlineComments(previewdiff_id=preview_diff_id)
     # Transform the inline comments
     simplified_comments = [
@@ -156,15 +189,94 @@ def get_diff_inline_comments_and_text_for_mp_and_diff(mp_obj, diff_obj):
                 simplified_comments[i]["messages"].extend(simplified_comments[j]["messages"])
                 simplified_comments.pop(j)
                 break
-    # read in the diff text
+    return simplified_comments
+
+
+def read_diff_text(diff_obj) -> str:
     diff_text_obj = diff_obj.diff_text
     with diff_text_obj.open("r") as diff_file:
         diff_txt: str = diff_file.read().decode("utf-8")
+    return diff_txt
+
+
+def get_diff_inline_comments_and_text_for_mp_and_diff(mp_obj, diff_obj):
+    simplified_comments = get_simplified_inline_comments_for_mp_and_diff(mp_obj, diff_obj.id)
+    diff_txt = read_diff_text(diff_obj)
     inline_comments = match_diff_comments_with_file(simplified_comments, diff_txt)
     return inline_comments, diff_txt
 
 
-def get_diffs_from_mp(num_diffs_to_fetch: int, lp_mp_obj=None, web_link: str = None) -> list[DiffType]:
+def get_preview_diff_content(
+    preview_diff_id: int,
+    preview_diff_link: str,
+    use_diff_store: bool = True,
+    diff_analysis_workers: int = None,
+) -> PreviewDiffContentType:
+    """
+    Returns the immutable content of a preview diff, downloading and parsing it only if it is not stored yet
+    """
+    if use_diff_store:
+        content = load_preview_diff_content(preview_diff_id)
+        if content is not None:
+            return content
+    diff_text = read_diff_text(LP.load(preview_diff_link))
+    diff_text_splits = get_diff_text_splits(diff_text)
+    per_file_info_list, diff_line_map = analyze_diff(diff_text, max_workers=diff_analysis_workers)
+    for file_info in per_file_info_list:
+        file_info.diff_text_snippet = diff_text_splits[file_info.file]
+    content = PreviewDiffContentType(
+        id=preview_diff_id,
+        diff_text=diff_text,
+        diff_per_file_info=per_file_info_list,
+        diff_line_map=diff_line_map,
+    )
+    if use_diff_store:
+        save_preview_diff_content(content)
+    return content
+
+
+def get_original_file_contents_for_preview_diff(
+    lp_mp_obj,
+    content: PreviewDiffContentType,
+    target_revision_id: str,
+    use_diff_store: bool = True,
+    file_retrieval_options: FileRetrievalOptionsType = None,
+) -> dict[str, str]:
+    """
+    Returns the original contents of the files touched by a preview diff, retrieving them from the git mirror only if
+    they are not stored yet for these file_retrieval_options
+    """
+    if file_retrieval_options is None:
+        file_retrieval_options = FileRetrievalOptionsType()
+    if use_diff_store:
+        original_file_contents = load_original_file_contents(content.id, file_retrieval_options)
+        if original_file_contents is not None:
+            return original_file_contents
+    original_file_contents = get_original_file_contents_for_snippets(
+        lp_mp_obj,
+        target_revision_id,
+        {file_info.file: file_info.diff_text_snippet for file_info in content.diff_per_file_info},
+        file_retrieval_options=file_retrieval_options,
+    )
+    if use_diff_store:
+        save_original_file_contents(content.id, file_retrieval_options, original_file_contents)
+    return original_file_contents
+
+
+def get_diffs_from_mp(
+    num_diffs_to_fetch: int,
+    lp_mp_obj=None,
+    web_link: str = None,
+    use_diff_store: bool = True,
+    file_retrieval_options: FileRetrievalOptionsType = None,
+    diff_analysis_workers: int = None,
+) -> list[DiffType]:
+    """
+    Returns the num_diffs_to_fetch most recent diffs of a merge proposal
+
+    diff_analysis_workers is passed to analyze_diff as max_workers, so scripts setting it must guard their entry point
+    with ``if __name__ == "__main__":``.
+    """
     if lp_mp_obj is None:
         lp_mp_obj = get_lp_mp_obj_from_url(web_link)
     diffs: list[DiffType] = []
@@ -173,20 +285,35 @@ def get_diffs_from_mp(num_diffs_to_fetch: int, lp_mp_obj=None, web_link: str = N
     for diff in lp_diffs:
         if num_diffs_to_fetch == 0:
             break
-        diff_obj = LP.load(diff["self_link"])
-        inline_comments_dicts, diff_text = get_diff_inline_comments_and_text_for_mp_and_diff(lp_mp_obj, diff_obj)
-        diff_per_file_info = get_all_diff_per_file_info(lp_mp_obj, diff_obj, diff_text)
+        content = get_preview_diff_content(
+            diff["id"], diff["self_link"], use_diff_store=use_diff_store, diff_analysis_workers=diff_analysis_workers
+        )
+        original_file_contents = get_original_file_contents_for_preview_diff(
+            lp_mp_obj,
+            content,
+            diff["target_revision_id"],
+            use_diff_store=use_diff_store,
+            file_retrieval_options=file_retrieval_options,
+        )
+        # inline comments can still be added to an existing preview diff, so they are always fetched
+        simplified_comments = get_simplified_inline_comments_for_mp_and_diff(lp_mp_obj, content.id)
+        inline_comments_dicts = match_diff_comments_with_file(
+            simplified_comments, content.diff_text, diff_line_map=content.diff_line_map
+        )
         diffs.append(
             DiffType(
                 inline_comments=[convert_inline_comments_dict_to_type(d) for d in inline_comments_dicts],
                 id=diff["id"],
                 self_link=diff["self_link"],
-                diff_text=diff_text,
+                diff_text=content.diff_text,
                 title=diff["title"],
                 date_created=diff["date_created"],
                 source_revision_id=diff["source_revision_id"],
                 target_revision_id=diff["target_revision_id"],
-                diff_per_file_info=diff_per_file_info,
+                diff_per_file_info=[
+                    dataclasses.replace(file_info, original_file_contents=original_file_contents[file_info.file])
+                    for file_info in content.diff_per_file_info
+                ],
             )
         )
         num_diffs_to_fetch -= 1
@@ -233,9 +360,15 @@ def get_lpyd_mp(
     lp_mp_obj=None,
     lp_mp_dict: dict = None,
     num_diffs_to_fetch=0,
+    use_diff_store: bool = True,
+    file_retrieval_options: FileRetrievalOptionsType = None,
+    diff_analysis_workers: int = None,
 ) -> MergeProposalType:
     """
     Returns a MergeProposalType object
+
+    diff_analysis_workers is passed to analyze_diff as max_workers, so scripts setting it must guard their entry point
+    with ``if __name__ == "__main__":``.
     """
     if lp_mp_obj is None:
         if not web_link:
@@ -259,7 +392,13 @@ def get_lpyd_mp(
         **source_and_target_info,
     )
     if num_diffs_to_fetch != 0:
-        lpyd_mp.diffs = get_diffs_from_mp(lp_mp_obj=lp_mp_obj, num_diffs_to_fetch=num_diffs_to_fetch)
+        lpyd_mp.diffs = get_diffs_from_mp(
+            lp_mp_obj=lp_mp_obj,
+            num_diffs_to_fetch=num_diffs_to_fetch,
+            use_diff_store=use_diff_store,
+            file_retrieval_options=file_retrieval_options,
+            diff_analysis_workers=diff_analysis_workers,
+        )
     return lpyd_mp
 
 
@@ -341,11 +480,24 @@ def get_all_repos(project_name: str):
 
 
 def get_file_contents_from_git_url_and_hash(
-    target_git_url: str, target_branch: str, target_hash: str, relevant_files: list[str]
+    target_git_url: str,
+    target_branch: str,
+    target_hash: str,
+    relevant_files: list[str],
+    file_retrieval_options: FileRetrievalOptionsType = None,
+    hunk_ranges: dict[str, list[tuple[int, int]]] = None,
 ) -> dict[str, str]:
     """
     Get the contents of the files in relevant_files from the git repo at git_url at the commit hash
+
+    See FileRetrievalOptionsType for how binary, large and partially needed files are handled. hunk_ranges maps file
+    paths to the original line ranges of their hunks (see parse_original_hunk_ranges) and is only used when
+    file_retrieval_options.context_lines is set.
     """
+    if file_retrieval_options is None:
+        file_retrieval_options = FileRetrievalOptionsType()
+    if hunk_ranges is None:
+        hunk_ranges = {}
     print(
         "Getting file contents from '{}' on branch '{}' at commit hash {}".format(
             target_git_url, target_branch, target_hash
@@ -402,10 +554,43 @@ def get_file_contents_from_git_url_and_hash(
         if not os.path.exists(full_path):
             file_contents[file_path] = ""
         else:
-            with open(full_path, "r") as f:
-                file_contents[file_path] = f.read()
+            file_contents[file_path] = read_original_file_contents(
+                full_path, file_retrieval_options, hunk_ranges.get(file_path, [])
+            )
     return file_contents
 
 
+def read_original_file_contents(
+    full_path: str, file_retrieval_options: FileRetrievalOptionsType, hunk_ranges: list[tuple[int, int]]
+) -> str:
+    """
+    Read a file from the cloned repo as text, honouring file_retrieval_options
+    """
+    # e.g. a directory for a submodule that is not checked out
+    if not os.path.isfile(full_path):
+        return NON_REGULAR_FILE_MARKER
+    file_size = os.path.getsize(full_path)
+    with open(full_path, "rb") as f:
+        head = f.read(BINARY_DETECTION_BYTES)
+        if file_retrieval_options.skip_binary_files and b"\0" in head:
+            return BINARY_FILE_MARKER.format(size=file_size)
+        if file_retrieval_options.context_lines is None and file_retrieval_options.max_file_size is not None:
+            # no need to read more than what is kept
+            rest = f.read(max(file_retrieval_options.max_file_size - len(head), 0))
+        else:
+            rest = f.read()
+    contents = (head + rest).decode("utf-8", errors="replace")
+    if file_retrieval_options.context_lines is not None:
+        contents = extract_hunk_context_windows(contents, hunk_ranges, file_retrieval_options.context_lines)
+        # the windows are what gets truncated, so the marker reports their size rather than the file's
+        return truncate_file_contents(
+            contents,
+            len(contents.encode("utf-8")),
+            file_retrieval_options.max_file_size,
+            truncation_marker=CONTEXT_TRUNCATION_MARKER,
+        )
+    return truncate_file_contents(contents, file_size, file_retrieval_options.max_file_size)
+
+
 if __name__ == "__main__":
     print("No functionality is provided by this module. Please invoke via cli.")
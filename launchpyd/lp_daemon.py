@@ -0,0 +1,318 @@
+"""
+Long-running daemon that keeps a logged-in Launchpad session, merge proposal caches and git mirrors warm, and answers
+queries from a lightweight client over a local Unix socket.
+
+Start the daemon with ``lpyd-daemon serve --project <name>`` and query it with e.g.
+``lpyd-daemon get-proposal <web_link>``.
+"""
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from typing import Optional
+
+import click
+
+from launchpyd import lp
+from launchpyd.lp_types import FileRetrievalOptionsType, MergeProposalType, to_dict
+
+DEFAULT_SOCKET_PATH = os.path.join(os.path.expanduser("~"), ".lpyd", "lpyd.sock")
+DEFAULT_POLL_INTERVAL = 300
+# seconds a client waits for the daemon, which may be busy with Launchpad for other queries or the poller
+DEFAULT_QUERY_TIMEOUT = 120
+
+
+class LpydDaemonState:
+    """
+    Holds the warm caches shared by the request handlers and the background poller.
+
+    All Launchpad access goes through ``lp_lock`` since launchpadlib is not thread safe.
+    """
+
+    def __init__(
+        self,
+        projects: list[str],
+        poll_interval: int = DEFAULT_POLL_INTERVAL,
+        file_retrieval_options: Optional[FileRetrievalOptionsType] = None,
+        diff_analysis_workers: Optional[int] = None,
+    ):
+        self.projects = projects
+        self.poll_interval = poll_interval
+        self.file_retrieval_options = file_retrieval_options
+        self.diff_analysis_workers = diff_analysis_workers
+        self.lp_lock = threading.RLock()
+        self.stop_event = threading.Event()
+        # (web_link, num_diffs_to_fetch) -> MergeProposalType
+        self.mp_cache: dict[tuple[str, int], MergeProposalType] = {}
+        # project_name -> web links of the project's merge proposals
+        self.project_cache: dict[str, list[str]] = {}
+
+    def get_proposal(self, web_link: str, num_diffs_to_fetch: int = 0, refresh: bool = False) -> MergeProposalType:
+        key = (web_link, num_diffs_to_fetch)
+        if refresh or key not in self.mp_cache:
+            with self.lp_lock:
+                self.mp_cache[key] = lp.get_lpyd_mp(
+                    web_link=web_link,
+                    num_diffs_to_fetch=num_diffs_to_fetch,
+                    file_retrieval_options=self.file_retrieval_options,
+                    diff_analysis_workers=self.diff_analysis_workers,
+                )
+        return self.mp_cache[key]
+
+    def list_project_proposals(self, project_name: str, refresh: bool = False) -> list[MergeProposalType]:
+        if refresh or project_name not in self.project_cache:
+            self.refresh_project(project_name)
+        return [self.get_proposal(web_link) for web_link in self.project_cache[project_name]]
+
+    def refresh_project(self, project_name: str):
+        """
+        Refresh the listing and every proposal of a project, skipping the proposals that cannot be fetched.
+        """
+        with self.lp_lock:
+            lp_mp_dicts = lp.get_mps_from_lp_project(project_name)
+        web_links = []
+        # take the lock per proposal so queries are not blocked until the whole project has been fetched
+        for lp_mp_dict in lp_mp_dicts:
+            try:
+                self.get_proposal(lp_mp_dict["web_link"], refresh=True)
+            except Exception as e:
+                print(f"Skipping merge proposal {lp_mp_dict.get('web_link')} of {project_name}: {e}")
+                continue
+            web_links.append(lp_mp_dict["web_link"])
+        self.project_cache[project_name] = web_links
+
+    def refresh_all(self):
+        refreshed_web_links = set()
+        for project_name in dict.fromkeys(self.projects + list(self.project_cache)):
+            try:
+                self.refresh_project(project_name)
+            except Exception as e:
+                print(f"Error while refreshing project {project_name}: {e}")
+                continue
+            refreshed_web_links.update(self.project_cache[project_name])
+        # proposals fetched on their own or with diffs are not covered by the project listings
+        for web_link, num_diffs_to_fetch in list(self.mp_cache):
+            if num_diffs_to_fetch == 0 and web_link in refreshed_web_links:
+                continue
+            try:
+                self.get_proposal(web_link, num_diffs_to_fetch=num_diffs_to_fetch, refresh=True)
+            except Exception as e:
+                print(f"Error while refreshing merge proposal {web_link}: {e}")
+
+    def poll_forever(self):
+        while not self.stop_event.is_set():
+            try:
+                self.refresh_all()
+            except Exception as e:
+                print(f"Error while polling Launchpad: {e}")
+            self.stop_event.wait(self.poll_interval)
+
+    def handle_query(self, query: dict):
+        command = query.get("command")
+        refresh = bool(query.get("refresh", False))
+        if command == "ping":
+            return "pong"
+        if command == "get_proposal":
+            return to_dict(self.get_proposal(query["web_link"], refresh=refresh))
+        if command == "list_project_proposals":
+            return [to_dict(mp) for mp in self.list_project_proposals(query["project_name"], refresh=refresh)]
+        if command == "get_diffs":
+            mp = self.get_proposal(
+                query["web_link"], num_diffs_to_fetch=int(query.get("num_diffs_to_fetch", 1)), refresh=refresh
+            )
+            return [to_dict(diff) for diff in mp.diffs]
+        if command == "stop":
+            self.stop_event.set()
+            return "stopping"
+        raise ValueError(f"Unknown command: {command}")
+
+
+class LpydRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads one JSON query per line and writes one JSON response per line.
+    """
+
+    def handle(self):
+        state: LpydDaemonState = self.server.state
+        for raw_query in self.rfile:
+            try:
+                response = {"ok": True, "result": state.handle_query(json.loads(raw_query))}
+            except Exception as e:
+                response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class LpydServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, state: LpydDaemonState):
+        self.state = state
+        super().__init__(socket_path, LpydRequestHandler)
+
+
+def remove_stale_socket(socket_path: str):
+    """
+    Remove a socket file left behind by a daemon that is no longer running.
+    """
+    if not os.path.exists(socket_path):
+        return
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.remove(socket_path)
+        return
+    raise RuntimeError(f"An lpyd daemon is already listening on {socket_path}")
+
+
+def run_daemon(
+    projects: list[str],
+    socket_path: str = DEFAULT_SOCKET_PATH,
+    poll_interval: int = DEFAULT_POLL_INTERVAL,
+    file_retrieval_options: Optional[FileRetrievalOptionsType] = None,
+    diff_analysis_workers: Optional[int] = None,
+):
+    """
+    Log into Launchpad once, start polling the given projects in the background and serve queries until stopped.
+    """
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    remove_stale_socket(socket_path)
+    lp.login()
+    state = LpydDaemonState(
+        projects=projects,
+        poll_interval=poll_interval,
+        file_retrieval_options=file_retrieval_options,
+        diff_analysis_workers=diff_analysis_workers,
+    )
+    poller = threading.Thread(target=state.poll_forever, name="lpyd-poller", daemon=True)
+    poller.start()
+    server = LpydServer(socket_path, state)
+    os.chmod(socket_path, 0o600)
+    server_thread = threading.Thread(target=server.serve_forever, name="lpyd-server", daemon=True)
+    server_thread.start()
+    print(f"lpyd daemon listening on {socket_path}")
+    try:
+        while not state.stop_event.is_set():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        state.stop_event.set()
+    finally:
+        server.shutdown()
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def send_daemon_query(
+    command: str, socket_path: str = DEFAULT_SOCKET_PATH, timeout: Optional[float] = DEFAULT_QUERY_TIMEOUT, **params
+):
+    """
+    Send a single query to a running daemon and return its result.
+
+    Raises OSError if the daemon cannot be reached or does not answer within timeout seconds, and RuntimeError if the
+    daemon answers with an error.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps({"command": command, **params}).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as response_file:
+            response = json.loads(response_file.readline())
+    if not response["ok"]:
+        raise RuntimeError(response["error"])
+    return response["result"]
+
+
+@click.group()
+@click.option("--socket-path", default=DEFAULT_SOCKET_PATH, show_default=True, help="Path of the daemon's socket.")
+@click.option(
+    "--timeout", default=DEFAULT_QUERY_TIMEOUT, show_default=True, help="Seconds to wait for the daemon's answer."
+)
+@click.pass_context
+def cli(ctx, socket_path, timeout):
+    ctx.obj = {"socket_path": socket_path, "timeout": timeout}
+
+
+@cli.command()
+@click.option("--project", "projects", multiple=True, help="Project to poll in the background. Can be repeated.")
+@click.option("--poll-interval", default=DEFAULT_POLL_INTERVAL, show_default=True, help="Seconds between polls.")
+@click.option("--max-file-size", type=int, default=None, help="Truncate original file contents after this many bytes.")
+@click.option("--context-lines", type=int, default=None, help="Only keep original file lines this close to a hunk.")
+@click.option(
+    "--diff-analysis-workers",
+    type=int,
+    default=None,
+    help="Parse diffs of at least a few MB across this many processes instead of serially. Off by default.",
+)
+@click.pass_context
+def serve(ctx, projects, poll_interval, max_file_size, context_lines, diff_analysis_workers):
+    """Run the daemon in the foreground."""
+    run_daemon(
+        projects=list(projects),
+        socket_path=ctx.obj["socket_path"],
+        poll_interval=poll_interval,
+        file_retrieval_options=FileRetrievalOptionsType(max_file_size=max_file_size, context_lines=context_lines),
+        diff_analysis_workers=diff_analysis_workers,
+    )
+
+
+def print_query_result(ctx, command: str, **params):
+    socket_path = ctx.obj["socket_path"]
+    try:
+        result = send_daemon_query(command, socket_path=socket_path, timeout=ctx.obj["timeout"], **params)
+    except (FileNotFoundError, ConnectionRefusedError):
+        raise click.ClickException(f"No lpyd daemon is running on {socket_path}, start one with 'lpyd-daemon serve'")
+    except socket.timeout:
+        raise click.ClickException(f"The lpyd daemon on {socket_path} did not answer within {ctx.obj['timeout']}s")
+    except (OSError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+    click.echo(json.dumps(result, indent=2))
+
+
+@cli.command()
+@click.pass_context
+def ping(ctx):
+    """Check that the daemon is running."""
+    print_query_result(ctx, "ping")
+
+
+@cli.command("get-proposal")
+@click.argument("web_link")
+@click.option("--refresh", is_flag=True, help="Bypass the daemon's cache.")
+@click.pass_context
+def get_proposal(ctx, web_link, refresh):
+    """Get a single merge proposal."""
+    print_query_result(ctx, "get_proposal", web_link=web_link, refresh=refresh)
+
+
+@cli.command("list-proposals")
+@click.argument("project_name")
+@click.option("--refresh", is_flag=True, help="Bypass the daemon's cache.")
+@click.pass_context
+def list_proposals(ctx, project_name, refresh):
+    """List the merge proposals of a project."""
+    print_query_result(ctx, "list_project_proposals", project_name=project_name, refresh=refresh)
+
+
+@cli.command("get-diffs")
+@click.argument("web_link")
+@click.option("--num-diffs", default=1, show_default=True, help="Number of most recent diffs to fetch.")
+@click.option("--refresh", is_flag=True, help="Bypass the daemon's cache.")
+@click.pass_context
+def get_diffs(ctx, web_link, num_diffs, refresh):
+    """Get the most recent diffs of a merge proposal, including original file contents."""
+    print_query_result(ctx, "get_diffs", web_link=web_link, num_diffs_to_fetch=num_diffs, refresh=refresh)
+
+
+@cli.command()
+@click.pass_context
+def stop(ctx):
+    """Stop the daemon."""
+    print_query_result(ctx, "stop")
+
+
+if __name__ == "__main__":
+    cli()
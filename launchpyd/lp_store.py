@@ -0,0 +1,112 @@
+"""
+On-disk store for the immutable content of preview diffs.
+
+A preview diff never changes once Launchpad has created it, so its text, the parsed per-file info and the diff line
+map are stored keyed by the preview diff id and never expire. The original contents of the touched files depend on how
+they were retrieved, so they are stored separately, keyed by the preview diff id and the file retrieval options.
+"""
+import dataclasses
+import gzip
+import hashlib
+import os
+import pickle
+import tempfile
+from typing import Optional
+
+from launchpyd.lp_types import FileRetrievalOptionsType, PreviewDiffContentType
+
+PREVIEW_DIFF_STORE_DIR = os.path.join(os.path.expanduser("~"), ".lpyd", "preview_diff_store")
+# entries never expire, so bump this whenever the layout of the stored entries changes
+STORE_FORMAT_VERSION = 2
+
+
+def get_store_dir(store_dir: str = None) -> str:
+    return os.path.join(store_dir or PREVIEW_DIFF_STORE_DIR, f"v{STORE_FORMAT_VERSION}")
+
+
+def get_preview_diff_store_path(preview_diff_id: int, store_dir: str = None) -> str:
+    return os.path.join(get_store_dir(store_dir), f"{preview_diff_id}.pickle.gz")
+
+
+def get_original_file_contents_store_path(
+    preview_diff_id: int, file_retrieval_options: FileRetrievalOptionsType, store_dir: str = None
+) -> str:
+    options_key = hashlib.sha256(repr(file_retrieval_options).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(get_store_dir(store_dir), f"{preview_diff_id}.original_files.{options_key}.pickle.gz")
+
+
+def load_store_entry(path: str):
+    """
+    Returns the unpickled entry at path, or None if there is no readable entry.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with gzip.open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception as e:
+        # a truncated or incompatible entry is simply fetched again
+        print(f"Ignoring unreadable preview diff store entry {path}: {e}")
+        return None
+
+
+def save_store_entry(path: str, entry):
+    """
+    Stores an entry, replacing it atomically so concurrent readers never see partial data.
+    """
+    store_dir = os.path.dirname(path)
+    os.makedirs(store_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=store_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as raw_file, gzip.GzipFile(fileobj=raw_file, mode="wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def load_preview_diff_content(preview_diff_id: int, store_dir: str = None) -> Optional[PreviewDiffContentType]:
+    """
+    Returns the stored content of the preview diff, or None if it has not been stored yet.
+    """
+    content = load_store_entry(get_preview_diff_store_path(preview_diff_id, store_dir))
+    if content is None:
+        return None
+    # guard against entries pickled with other fields by a layout change that missed a STORE_FORMAT_VERSION bump
+    if not isinstance(content, PreviewDiffContentType) or any(
+        field.name not in vars(content) for field in dataclasses.fields(PreviewDiffContentType)
+    ):
+        print(f"Ignoring incompatible preview diff store entry for preview diff {preview_diff_id}")
+        return None
+    return content
+
+
+def save_preview_diff_content(content: PreviewDiffContentType, store_dir: str = None):
+    save_store_entry(get_preview_diff_store_path(content.id, store_dir), content)
+
+
+def load_original_file_contents(
+    preview_diff_id: int, file_retrieval_options: FileRetrievalOptionsType, store_dir: str = None
+) -> Optional[dict[str, str]]:
+    """
+    Returns the stored original file contents of the preview diff for these options, or None if there are none yet.
+    """
+    original_file_contents = load_store_entry(
+        get_original_file_contents_store_path(preview_diff_id, file_retrieval_options, store_dir)
+    )
+    if not isinstance(original_file_contents, dict):
+        return None
+    return original_file_contents
+
+
+def save_original_file_contents(
+    preview_diff_id: int,
+    file_retrieval_options: FileRetrievalOptionsType,
+    original_file_contents: dict[str, str],
+    store_dir: str = None,
+):
+    save_store_entry(
+        get_original_file_contents_store_path(preview_diff_id, file_retrieval_options, store_dir),
+        original_file_contents,
+    )
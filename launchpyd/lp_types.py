@@ -1,7 +1,7 @@
 import dataclasses
 import json
 from datetime import datetime
-from typing import List, Literal, Optional, Type, TypeVar
+from typing import Dict, List, Literal, Optional, Tuple, Type, TypeVar
 
 # Define a type variable for our dataclasses
 T = TypeVar("T")
@@ -55,6 +55,33 @@ class DiffType:
     diff_text: Optional[str] = None
 
 
+@dataclasses.dataclass
+class FileRetrievalOptionsType:
+    """
+    Controls how the original contents of the files touched by a diff are retrieved.
+    """
+
+    # replace files that look binary (contain a NUL byte near the start) with a marker
+    skip_binary_files: bool = True
+    # cut the contents after this many bytes and append a truncation marker
+    max_file_size: Optional[int] = None
+    # only keep the original lines within this many lines of each hunk, marking the omitted lines
+    context_lines: Optional[int] = None
+
+
+@dataclasses.dataclass
+class PreviewDiffContentType:
+    """
+    The immutable parts of a preview diff, as kept in the on-disk preview diff store.
+    """
+
+    id: int
+    diff_text: str
+    diff_per_file_info: List[DiffPerFileInfoType] = dataclasses.field(default_factory=list)
+    # maps diff line numbers to (file, relative line number), see lp_utils.build_diff_line_map
+    diff_line_map: Dict[int, Tuple[str, int]] = dataclasses.field(default_factory=dict)
+
+
 @dataclasses.dataclass
 class MergeProposalReviewVote:
     reviewer_username: str
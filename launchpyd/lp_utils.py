@@ -1,7 +1,28 @@
+import multiprocessing
 import re
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+from multiprocessing import shared_memory
 
 from launchpyd.lp_types import DiffPerFileInfoType
 
+# same heuristic as git: a file is binary if it contains a NUL byte in its first 8000 bytes
+BINARY_DETECTION_BYTES = 8000
+BINARY_FILE_MARKER = "[lpyd: binary file omitted, {size} bytes]"
+NON_REGULAR_FILE_MARKER = "[lpyd: not a regular file, omitted]"
+TRUNCATION_MARKER = "[lpyd: truncated after {kept} of {size} bytes]"
+CONTEXT_TRUNCATION_MARKER = "[lpyd: hunk context truncated after {kept} of {size} bytes]"
+OMITTED_LINES_MARKER = "[lpyd: {count} original lines omitted]"
+
+# process pools of analyze_diff keyed by their number of workers, reused so each diff does not start a new pool
+DIFF_ANALYSIS_EXECUTORS: dict[int, ProcessPoolExecutor] = {}
+DIFF_ANALYSIS_EXECUTORS_LOCK = threading.Lock()
+# smaller diffs are analyzed serially by analyze_diff, as the pool round trips would dominate
+MIN_SHARDED_DIFF_SIZE = 4 * 1024 * 1024
+
 
 def extract_file_and_line_from_diff(line_number, diff_txt) -> tuple[str, int, str]:
     """
@@ -60,19 +81,92 @@ def extract_file_and_line_from_diff(line_number, diff_txt) -> tuple[str, int, st
     return None, None, None
 
 
+def build_diff_line_map(diff_txt) -> dict[int, tuple[str, int]]:
+    """
+    Maps every line number of a diff to its file path and relative line number in a single pass.
+
+    Gives the same file and line as extract_file_and_line_from_diff for every line number it can resolve, so
+    the map can be stored alongside the diff and reused for comments that are added later.
+
+    Args:
+        diff_txt (str): The diff text to map.
+
+    Returns:
+        dict: A dict mapping diff line numbers (int) to tuples of file path (str) and relative line number (int).
+    """
+    return map_diff_lines(diff_txt.split("\n"))[0]
+
+
+def map_diff_lines(lines: list[str], first_line_no: int = 1) -> tuple[dict[int, tuple[str, int]], int, int, str, int]:
+    """
+    The loop behind build_diff_line_map, usable on a slice of a diff's lines.
+
+    Mapping starts without a current file and with a relative line number of 0, so for lines before the first hunk
+    header of the slice the returned line numbers are offsets from the state left by the previous slice (and the file
+    is None until a "+++ " line is seen).
+
+    Args:
+        lines (list): The diff lines to map.
+        first_line_no (int): The line number of lines[0] within the whole diff.
+
+    Returns:
+        tuple: The line map (dict), the line numbers of the first hunk header and of the first "+++ " line or None
+        if there is none (int), and the current file (str) and relative line number of the next line (int) at the
+        end of the slice.
+    """
+    line_map = {}
+    first_hunk_line_no = None
+    first_file_line_no = None
+    current_file = None
+    current_line_number_in_file = 0
+    added_lines = 0
+    removed_lines = 0
+
+    for i, line in enumerate(lines, start=first_line_no):
+        if line.startswith("+++ "):
+            current_file = line.split(" ")[1][2:]
+            if first_file_line_no is None:
+                first_file_line_no = i
+
+        elif line.startswith("@@"):
+            _, chunk_info = line.split("@@", 1)
+            current_line_number_in_file = int(chunk_info.split(" ")[2].split(",")[0])
+            added_lines = 0
+            removed_lines = 0
+            if current_line_number_in_file == 0:
+                current_line_number_in_file = 1
+            if first_hunk_line_no is None:
+                first_hunk_line_no = i
+            continue
+
+        line_map[i] = (current_file, current_line_number_in_file + added_lines - removed_lines)
+
+        if line.startswith("+"):
+            added_lines += 1
+        elif line.startswith("-"):
+            removed_lines += 1
+        else:
+            current_line_number_in_file += 1
+
+    next_line_number = current_line_number_in_file + added_lines - removed_lines
+    return line_map, first_hunk_line_no, first_file_line_no, current_file, next_line_number
+
+
 # for each entry in a comments.json file,
 # add a new key-value pair to the entry with the file and relative line number
 # then write the updated comments to a new json file
-def match_diff_comments_with_file(comments, diff_txt):
+def match_diff_comments_with_file(comments, diff_txt, diff_line_map: dict[int, tuple[str, int]] = None):
     """
     For each entry in a comments.json file, add new key-value pairs to the entry with the file and relative line number, then return the updated comments.
+
+    If diff_line_map (as returned by build_diff_line_map) is given, it is used instead of re-parsing diff_txt.
     """
+    if diff_line_map is None:
+        diff_line_map = build_diff_line_map(diff_txt)
     new_comments = []
     for comment in comments:
         new_comment = comment.copy()
-        file, relative_line, line_content = extract_file_and_line_from_diff(
-            line_number=comment["diff_line_no"], diff_txt=diff_txt
-        )
+        file, relative_line = diff_line_map.get(comment["diff_line_no"], (None, None))
         new_comment["file"] = file
         del new_comment["diff_line_no"]
         new_comment["line_no"] = relative_line
@@ -150,3 +244,240 @@ def parse_base_diff_per_file_info(diff_text: str) -> list[DiffPerFileInfoType]:
         parsed_data.append(DiffPerFileInfoType(**current_file))
 
     return parsed_data
+
+
+def parse_original_hunk_ranges(diff_text_snippet: str) -> list[tuple[int, int]]:
+    """
+    Returns the (start line, line count) of every hunk in a file's diff, relative to the original file.
+    """
+    hunk_header_regex = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+\d+(?:,\d+)? @@", re.MULTILINE)
+    return [
+        (int(match.group(1)), int(match.group(2)) if match.group(2) is not None else 1)
+        for match in hunk_header_regex.finditer(diff_text_snippet)
+    ]
+
+
+def extract_hunk_context_windows(contents: str, hunk_ranges: list[tuple[int, int]], context_lines: int) -> str:
+    """
+    Keeps only the lines of contents within context_lines of any hunk, replacing each run of omitted lines with a
+    marker line.
+    """
+    lines = contents.split("\n")
+    # the empty string after a trailing newline is not a line of the file
+    has_trailing_newline = lines[-1] == "" and len(lines) > 1
+    if lines[-1] == "":
+        lines.pop()
+    windows = []
+    for start, count in sorted(hunk_ranges):
+        # a hunk with a count of 0 inserts lines after line `start`
+        low = max(1, start - context_lines)
+        high = min(len(lines), start + max(count, 1) - 1 + context_lines)
+        if windows and low <= windows[-1][1] + 1:
+            windows[-1][1] = max(windows[-1][1], high)
+        elif low <= high:
+            windows.append([low, high])
+
+    kept_lines = []
+    next_line = 1
+    for low, high in windows:
+        if low > next_line:
+            kept_lines.append(OMITTED_LINES_MARKER.format(count=low - next_line))
+        kept_lines.extend(lines[low - 1 : high])
+        next_line = high + 1
+    if next_line <= len(lines):
+        kept_lines.append(OMITTED_LINES_MARKER.format(count=len(lines) - next_line + 1))
+    elif has_trailing_newline:
+        kept_lines.append("")
+    return "\n".join(kept_lines)
+
+
+def truncate_file_contents(
+    contents: str, file_size: int, max_file_size: int = None, truncation_marker: str = TRUNCATION_MARKER
+) -> str:
+    """
+    Cuts contents after max_file_size bytes of utf-8, appending a truncation marker if anything was cut.
+
+    file_size is the size of what contents was read from, which is reported in the marker.
+    """
+    if max_file_size is None or file_size <= max_file_size:
+        return contents
+    kept = contents.encode("utf-8")[:max_file_size].decode("utf-8", errors="ignore")
+    return kept + "\n" + truncation_marker.format(kept=max_file_size, size=file_size)
+
+
+def find_diff_shard_boundaries(diff_text: str, num_shards: int) -> list[tuple[int, int]]:
+    """
+    Splits a diff into up to num_shards (start, end) ranges of roughly equal size.
+
+    Ranges only start at the "diff --git" line of a file section, so each one can be parsed on its own. The newline
+    ending the previous range is left out so the line lists of the ranges add up to the line list of the whole diff.
+    """
+    diff_start_regex = re.compile(r"^diff --git a/(.+) b/(.+)$", re.MULTILINE)
+    target_shard_size = len(diff_text) / num_shards
+    shard_starts = [0]
+    for match in diff_start_regex.finditer(diff_text):
+        if match.start() - shard_starts[-1] >= target_shard_size:
+            shard_starts.append(match.start())
+    shard_ends = [start - 1 for start in shard_starts[1:]] + [len(diff_text)]
+    return list(zip(shard_starts, shard_ends))
+
+
+def get_diff_analysis_executor(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Returns the process pool of analyze_diff for max_workers, starting it on first use.
+
+    Workers are started with forkserver (or spawn where that is unavailable) rather than fork, since analyze_diff is
+    called from the daemon's threads and forking a multi-threaded process can deadlock the children.
+    """
+    with DIFF_ANALYSIS_EXECUTORS_LOCK:
+        if max_workers not in DIFF_ANALYSIS_EXECUTORS:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            DIFF_ANALYSIS_EXECUTORS[max_workers] = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=multiprocessing.get_context(start_method)
+            )
+        return DIFF_ANALYSIS_EXECUTORS[max_workers]
+
+
+def compact_line_map(
+    line_map: dict[int, tuple[str, int]], first_line_no: int, last_line_no: int
+) -> tuple[list[tuple[str, int, array]], list[int]]:
+    """
+    Packs the line map of the lines first_line_no to last_line_no into runs of (file, first line number, relative line
+    numbers) and the line numbers without an entry. Arrays pickle far faster than a dict with an entry per line.
+    """
+    runs = []
+    missing_line_nos = []
+    run_file = None
+    relative_lines = None
+    for line_no in range(first_line_no, last_line_no + 1):
+        entry = line_map.get(line_no)
+        if entry is None:
+            # keep hunk headers in the current run, they are dropped again by expand_line_map
+            missing_line_nos.append(line_no)
+            entry = (run_file, 0)
+        file, relative_line = entry
+        if relative_lines is None or file != run_file:
+            run_file = file
+            relative_lines = array("q")
+            runs.append((file, line_no, relative_lines))
+        relative_lines.append(relative_line)
+    return runs, missing_line_nos
+
+
+def expand_line_map(
+    runs: list[tuple[str, int, array]], missing_line_nos: list[int], line_map: dict[int, tuple[str, int]]
+):
+    """
+    Adds the entries packed by compact_line_map to line_map.
+    """
+    for file, first_line_no, relative_lines in runs:
+        line_map.update(
+            zip(range(first_line_no, first_line_no + len(relative_lines)), zip(repeat(file), relative_lines))
+        )
+    for line_no in missing_line_nos:
+        del line_map[line_no]
+
+
+def analyze_diff_shard(shared_memory_name: str, start: int, end: int, first_line_no: int):
+    """
+    Process pool worker: parses the per file info and maps the lines of one shard of a diff held in shared memory.
+
+    Returns the per file info, the line map packed by compact_line_map and the rest of the result of map_diff_lines.
+    """
+    diff_shared_memory = shared_memory.SharedMemory(name=shared_memory_name)
+    try:
+        shard_text = bytes(diff_shared_memory.buf[start:end]).decode("utf-8")
+    finally:
+        diff_shared_memory.close()
+    lines = shard_text.split("\n")
+    line_map, *line_mapping_state = map_diff_lines(lines, first_line_no)
+    return (
+        parse_base_diff_per_file_info(shard_text),
+        compact_line_map(line_map, first_line_no, first_line_no + len(lines) - 1),
+        line_mapping_state,
+    )
+
+
+def analyze_diff(
+    diff_text: str, max_workers: int = None, min_sharded_size: int = MIN_SHARDED_DIFF_SIZE
+) -> tuple[list[DiffPerFileInfoType], dict[int, tuple[str, int]]]:
+    """
+    Returns the per file info (see parse_base_diff_per_file_info) and the line map (see build_diff_line_map) of a diff.
+
+    If max_workers is greater than 1 and the diff has at least min_sharded_size characters, the diff is sharded by file
+    section across a shared process pool of that size. The shards are handed to the workers once through shared memory
+    and the results are identical to the serial path. Whether this is faster depends on the number of cores and the
+    diff, so measure before enabling it.
+
+    The pool starts its workers with forkserver or spawn, which re-import the __main__ module, so a script using
+    max_workers must guard its entry point with ``if __name__ == "__main__":``.
+    """
+    if not max_workers or max_workers < 2 or len(diff_text) < min_sharded_size:
+        shard_boundaries = []
+    else:
+        shard_boundaries = find_diff_shard_boundaries(diff_text, max_workers * 4)
+    if len(shard_boundaries) < 2:
+        return parse_base_diff_per_file_info(diff_text), build_diff_line_map(diff_text)
+
+    shard_bytes = [diff_text[start:end].encode("utf-8") for start, end in shard_boundaries]
+    diff_shared_memory = shared_memory.SharedMemory(create=True, size=sum(len(b) for b in shard_bytes))
+    try:
+        executor = get_diff_analysis_executor(max_workers)
+        futures = []
+        shard_line_ranges = []
+        first_line_no = 1
+        offset = 0
+        for (start, end), encoded_shard in zip(shard_boundaries, shard_bytes):
+            diff_shared_memory.buf[offset : offset + len(encoded_shard)] = encoded_shard
+            end_line_no = first_line_no + diff_text.count("\n", start, end)
+            shard_line_ranges.append((first_line_no, end_line_no))
+            futures.append(
+                executor.submit(
+                    analyze_diff_shard, diff_shared_memory.name, offset, offset + len(encoded_shard), first_line_no
+                )
+            )
+            offset += len(encoded_shard)
+            # the newline between two shards belongs to neither of them
+            first_line_no = end_line_no + 1
+        del shard_bytes
+        try:
+            shard_results = [future.result() for future in futures]
+        except BrokenProcessPool:
+            # start a fresh pool on the next call
+            with DIFF_ANALYSIS_EXECUTORS_LOCK:
+                DIFF_ANALYSIS_EXECUTORS.pop(max_workers, None)
+            raise
+    finally:
+        diff_shared_memory.close()
+        diff_shared_memory.unlink()
+
+    per_file_info_list = []
+    line_map = {}
+    # file and relative line number of the next line, carried across shards like in the serial loop
+    current_file = None
+    current_line_number = 0
+    for (shard_first_line_no, shard_last_line_no), (shard_per_file_info, packed_line_map, line_mapping_state) in zip(
+        shard_line_ranges, shard_results
+    ):
+        first_hunk_line_no, first_file_line_no, shard_file, shard_line_number = line_mapping_state
+        per_file_info_list.extend(shard_per_file_info)
+        expand_line_map(*packed_line_map, line_map)
+        # only the lines before the shard's first hunk header and "+++ " line depend on the previous shards
+        offset_end = first_hunk_line_no if first_hunk_line_no is not None else shard_last_line_no + 1
+        file_end = first_file_line_no if first_file_line_no is not None else shard_last_line_no + 1
+        for line_no in range(shard_first_line_no, max(offset_end, file_end)):
+            if line_no not in line_map:
+                continue
+            file, relative_line = line_map[line_no]
+            if line_no < file_end:
+                file = current_file
+            if line_no < offset_end:
+                relative_line += current_line_number
+            line_map[line_no] = (file, relative_line)
+        if shard_file is not None:
+            current_file = shard_file
+        if first_hunk_line_no is None:
+            current_line_number += shard_line_number
+        else:
+            current_line_number = shard_line_number
+    return per_file_info_list, line_map
@@ -0,0 +1,155 @@
+from unittest import mock
+
+import pytest
+
+from launchpyd import lp, lp_store
+from launchpyd.lp_types import FileRetrievalOptionsType
+from launchpyd.lp_utils import (
+    BINARY_DETECTION_BYTES,
+    BINARY_FILE_MARKER,
+    CONTEXT_TRUNCATION_MARKER,
+    NON_REGULAR_FILE_MARKER,
+    OMITTED_LINES_MARKER,
+    TRUNCATION_MARKER,
+)
+
+DIFF_TEXT = """diff --git a/foo.py b/foo.py
+index 1234567..89abcde 100644
+--- a/foo.py
++++ b/foo.py
+@@ -1,3 +1,4 @@
+ a
+-b
++c
++d
+ e
+"""
+
+
+@pytest.fixture
+def lp_mp_obj(mocker, tmp_path):
+    """
+    A merge proposal with a single preview diff, with Launchpad, the git mirror and the store directory stubbed out.
+    """
+    mocker.patch.object(lp_store, "PREVIEW_DIFF_STORE_DIR", str(tmp_path))
+    diff_obj = mock.Mock(target_revision_id="abc")
+    diff_obj.diff_text.open.return_value.__enter__ = lambda self: mock.Mock(read=lambda: DIFF_TEXT.encode("utf-8"))
+    diff_obj.diff_text.open.return_value.__exit__ = lambda self, *args: None
+    mocker.patch.object(lp, "LP", mock.Mock(**{"load.return_value": diff_obj}))
+    mocker.patch.object(
+        lp,
+        "get_file_contents_from_git_url_and_hash",
+        side_effect=lambda relevant_files, **kwargs: {file: "a\nb\ne\n" for file in relevant_files},
+    )
+    lp_mp_obj = mock.Mock(
+        target_git_repository_link="https://api.launchpad.net/devel/~owner/project/+git/repo",
+        target_git_path="refs/heads/main",
+    )
+    lp_mp_obj.preview_diffs.entries = [
+        {
+            "id": 7,
+            "self_link": "https://api.launchpad.net/devel/~owner/project/+git/repo/+merge/1/+preview-diff/7",
+            "title": "diff",
+            "date_created": "2024-01-01T00:00:00+00:00",
+            "source_revision_id": "def",
+            "target_revision_id": "abc",
+        }
+    ]
+    lp_mp_obj.getInlineComments.return_value = [
+        {
+            "line_number": "8",
+            "person": {"name": "reviewer", "display_name": "Reviewer"},
+            "text": "why?",
+            "date": "2024-01-02T00:00:00+00:00",
+        }
+    ]
+    return lp_mp_obj
+
+
+class TestGetDiffsFromMp:
+    def test_revisit_only_fetches_inline_comments(self, mocker, lp_mp_obj):
+        first = lp.get_diffs_from_mp(1, lp_mp_obj=lp_mp_obj)
+        read_diff_text = mocker.spy(lp, "read_diff_text")
+        analyze_diff = mocker.spy(lp, "analyze_diff")
+        lp.LP.load.reset_mock()
+        lp.get_file_contents_from_git_url_and_hash.reset_mock()
+        lp_mp_obj.getInlineComments.reset_mock()
+
+        second = lp.get_diffs_from_mp(1, lp_mp_obj=lp_mp_obj)
+
+        assert second == first
+        comment = second[0].inline_comments[0]
+        assert (comment.file, comment.line_no) == lp.extract_file_and_line_from_diff(8, DIFF_TEXT)[:2]
+        assert second[0].diff_per_file_info[0].original_file_contents == "a\nb\ne\n"
+        lp.LP.load.assert_not_called()
+        read_diff_text.assert_not_called()
+        analyze_diff.assert_not_called()
+        lp.get_file_contents_from_git_url_and_hash.assert_not_called()
+        lp_mp_obj.getInlineComments.assert_called_once_with(previewdiff_id=7)
+
+    def test_without_store_fetches_again(self, lp_mp_obj):
+        lp.get_diffs_from_mp(1, lp_mp_obj=lp_mp_obj, use_diff_store=False)
+        lp.get_diffs_from_mp(1, lp_mp_obj=lp_mp_obj, use_diff_store=False)
+        assert lp.LP.load.call_count == 2
+        assert lp.get_file_contents_from_git_url_and_hash.call_count == 2
+
+
+class TestReadOriginalFileContents:
+    def test_binary_file(self, tmp_path):
+        path = tmp_path / "image.png"
+        path.write_bytes(b"\x89PNG\x00\x01\x02")
+        assert lp.read_original_file_contents(str(path), FileRetrievalOptionsType(), []) == BINARY_FILE_MARKER.format(
+            size=7
+        )
+
+    def test_binary_file_kept_when_not_skipped(self, tmp_path):
+        path = tmp_path / "data.bin"
+        path.write_bytes(b"ab\x00cd")
+        options = FileRetrievalOptionsType(skip_binary_files=False)
+        assert lp.read_original_file_contents(str(path), options, []) == "ab\x00cd"
+
+    def test_non_utf8_file_is_decoded_with_replacement(self, tmp_path):
+        path = tmp_path / "latin1.txt"
+        path.write_bytes("café\n".encode("latin-1"))
+        assert lp.read_original_file_contents(str(path), FileRetrievalOptionsType(), []) == "caf�\n"
+
+    def test_directory(self, tmp_path):
+        assert lp.read_original_file_contents(str(tmp_path), FileRetrievalOptionsType(), []) == NON_REGULAR_FILE_MARKER
+
+    def test_max_file_size_reads_only_what_is_kept(self, tmp_path, mocker):
+        path = tmp_path / "big.txt"
+        path.write_bytes(b"x" * 100000)
+        bytes_read = []
+        real_open = open
+
+        class RecordingFile:
+            def __init__(self, *args, **kwargs):
+                self.file = real_open(*args, **kwargs)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                self.file.close()
+
+            def read(self, size=-1):
+                data = self.file.read(size)
+                bytes_read.append(len(data))
+                return data
+
+        mocker.patch("builtins.open", RecordingFile)
+        result = lp.read_original_file_contents(str(path), FileRetrievalOptionsType(max_file_size=10), [])
+        assert result == "x" * 10 + "\n" + TRUNCATION_MARKER.format(kept=10, size=100000)
+        assert sum(bytes_read) <= BINARY_DETECTION_BYTES
+
+    def test_context_windows_with_max_file_size(self, tmp_path):
+        path = tmp_path / "module.py"
+        path.write_text("".join(f"line {i}\n" for i in range(1, 101)))
+        options = FileRetrievalOptionsType(context_lines=1, max_file_size=20)
+        windows = "line 49\nline 50\nline 51\n"
+        expected_windows = OMITTED_LINES_MARKER.format(count=48) + "\n" + windows
+        expected_windows += OMITTED_LINES_MARKER.format(count=49)
+        result = lp.read_original_file_contents(str(path), options, [(50, 1)])
+        assert result == expected_windows.encode("utf-8")[:20].decode(
+            "utf-8"
+        ) + "\n" + CONTEXT_TRUNCATION_MARKER.format(kept=20, size=len(expected_windows.encode("utf-8")))
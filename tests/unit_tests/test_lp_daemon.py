@@ -0,0 +1,126 @@
+import threading
+
+import click
+import pytest
+
+from launchpyd import lp_daemon
+from launchpyd.lp_daemon import LpydDaemonState, LpydServer, send_daemon_query
+from launchpyd.lp_types import MergeProposalType
+
+
+def make_mp(web_link: str) -> MergeProposalType:
+    return MergeProposalType(
+        id=web_link.split("/")[-1],
+        self_link=web_link,
+        repo_name="repo",
+        url=web_link,
+        source_git_url="source",
+        target_git_url="target",
+        source_branch="feature",
+        target_branch="main",
+        source_owner="someone",
+        target_owner="someone-else",
+        review_state="Needs review",
+    )
+
+
+@pytest.fixture
+def fake_lp(mocker):
+    """
+    Stubs the Launchpad calls of the daemon, recording every fetched (web_link, num_diffs_to_fetch).
+    """
+    fetched = []
+    failing_web_links = set()
+    projects = {}
+
+    def get_lpyd_mp(web_link, num_diffs_to_fetch, **kwargs):
+        fetched.append((web_link, num_diffs_to_fetch))
+        if web_link in failing_web_links:
+            raise ValueError(f"cannot fetch {web_link}")
+        return make_mp(web_link)
+
+    mocker.patch.object(lp_daemon.lp, "get_lpyd_mp", side_effect=get_lpyd_mp)
+    mocker.patch.object(
+        lp_daemon.lp,
+        "get_mps_from_lp_project",
+        side_effect=lambda project_name: [{"web_link": web_link} for web_link in projects[project_name]],
+    )
+    return fetched, failing_web_links, projects
+
+
+class TestLpydDaemonState:
+    def test_handle_query_dispatch(self, fake_lp):
+        _, _, projects = fake_lp
+        projects["proj"] = ["proj/1", "proj/2"]
+        state = LpydDaemonState(projects=[])
+        assert state.handle_query({"command": "ping"}) == "pong"
+        assert state.handle_query({"command": "get_proposal", "web_link": "proj/1"})["url"] == "proj/1"
+        listed = state.handle_query({"command": "list_project_proposals", "project_name": "proj"})
+        assert [mp["url"] for mp in listed] == ["proj/1", "proj/2"]
+        assert state.handle_query({"command": "get_diffs", "web_link": "proj/1", "num_diffs_to_fetch": 2}) == []
+        assert state.handle_query({"command": "stop"}) == "stopping"
+        assert state.stop_event.is_set()
+        with pytest.raises(ValueError, match="Unknown command"):
+            state.handle_query({"command": "bogus"})
+
+    def test_cache_hits_and_refresh(self, fake_lp):
+        fetched, _, _ = fake_lp
+        state = LpydDaemonState(projects=[])
+        state.get_proposal("proj/1")
+        state.get_proposal("proj/1")
+        assert fetched == [("proj/1", 0)]
+        state.get_proposal("proj/1", refresh=True)
+        state.get_proposal("proj/1", num_diffs_to_fetch=1)
+        assert fetched == [("proj/1", 0), ("proj/1", 0), ("proj/1", 1)]
+
+    def test_refresh_all_skips_proposals_covered_by_projects(self, fake_lp):
+        fetched, _, projects = fake_lp
+        projects.update({"polled": ["polled/1"], "listed": ["listed/1"]})
+        state = LpydDaemonState(projects=["polled"])
+        state.list_project_proposals("listed")
+        state.get_proposal("other/1")
+        state.get_proposal("polled/1", num_diffs_to_fetch=2)
+        fetched.clear()
+        state.refresh_all()
+        assert sorted(fetched) == [("listed/1", 0), ("other/1", 0), ("polled/1", 0), ("polled/1", 2)]
+
+    def test_failing_proposal_does_not_stop_refresh(self, fake_lp):
+        fetched, failing_web_links, projects = fake_lp
+        projects.update({"proj": ["proj/w1", "proj/bzr", "proj/w2"], "later": ["later/1"]})
+        failing_web_links.add("proj/bzr")
+        state = LpydDaemonState(projects=["proj", "later"])
+        state.refresh_all()
+        assert state.project_cache == {"proj": ["proj/w1", "proj/w2"], "later": ["later/1"]}
+        assert [mp.url for mp in state.list_project_proposals("proj")] == ["proj/w1", "proj/w2"]
+
+    def test_failing_project_does_not_stop_refresh(self, fake_lp):
+        _, _, projects = fake_lp
+        projects["later"] = ["later/1"]
+        state = LpydDaemonState(projects=["missing", "later"])
+        state.refresh_all()
+        assert state.project_cache == {"later": ["later/1"]}
+
+
+class TestSendDaemonQuery:
+    @pytest.fixture
+    def socket_path(self, fake_lp, tmp_path):
+        socket_path = str(tmp_path / "lpyd.sock")
+        server = LpydServer(socket_path, LpydDaemonState(projects=[]))
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        yield socket_path
+        server.shutdown()
+        server.server_close()
+
+    def test_round_trip(self, socket_path):
+        assert send_daemon_query("ping", socket_path=socket_path) == "pong"
+        assert send_daemon_query("get_proposal", socket_path=socket_path, web_link="proj/1")["url"] == "proj/1"
+
+    def test_error_response(self, socket_path):
+        with pytest.raises(RuntimeError, match="Unknown command: bogus"):
+            send_daemon_query("bogus", socket_path=socket_path)
+
+    def test_cli_reports_missing_daemon(self, tmp_path):
+        ctx = click.Context(lp_daemon.cli, obj={"socket_path": str(tmp_path / "missing.sock"), "timeout": 1})
+        with pytest.raises(click.ClickException, match="No lpyd daemon is running"):
+            lp_daemon.print_query_result(ctx, "ping")
@@ -0,0 +1,54 @@
+import gzip
+import os
+
+from launchpyd.lp_store import (
+    STORE_FORMAT_VERSION,
+    get_preview_diff_store_path,
+    load_original_file_contents,
+    load_preview_diff_content,
+    save_original_file_contents,
+    save_preview_diff_content,
+)
+from launchpyd.lp_types import DiffPerFileInfoType, FileRetrievalOptionsType, PreviewDiffContentType
+
+
+def test_preview_diff_content_round_trip(tmp_path):
+    content = PreviewDiffContentType(
+        id=42,
+        diff_text="diff --git a/f b/f\n",
+        diff_per_file_info=[DiffPerFileInfoType(file="f", lines_added=1, lines_deleted=0)],
+        diff_line_map={1: ("f", 1)},
+    )
+    save_preview_diff_content(content, store_dir=str(tmp_path))
+    assert load_preview_diff_content(42, store_dir=str(tmp_path)) == content
+    assert load_preview_diff_content(43, store_dir=str(tmp_path)) is None
+
+
+def test_original_file_contents_are_kept_per_options(tmp_path):
+    full = FileRetrievalOptionsType()
+    windowed = FileRetrievalOptionsType(context_lines=3)
+    save_original_file_contents(42, full, {"f": "full"}, store_dir=str(tmp_path))
+    save_original_file_contents(42, windowed, {"f": "windowed"}, store_dir=str(tmp_path))
+    assert load_original_file_contents(42, full, store_dir=str(tmp_path)) == {"f": "full"}
+    assert load_original_file_contents(42, windowed, store_dir=str(tmp_path)) == {"f": "windowed"}
+    assert load_original_file_contents(42, FileRetrievalOptionsType(max_file_size=10), store_dir=str(tmp_path)) is None
+
+
+def test_unreadable_entries_are_a_miss(tmp_path):
+    path = get_preview_diff_store_path(42, store_dir=str(tmp_path))
+    os.makedirs(os.path.dirname(path))
+    with gzip.open(path, "wb") as f:
+        # a pickle referring to a module that does not exist
+        f.write(b"\x80\x04\x95\x1a\x00\x00\x00\x00\x00\x00\x00\x8c\x0emissing_module\x94\x8c\x03Foo\x94\x93\x94.")
+    assert load_preview_diff_content(42, store_dir=str(tmp_path)) is None
+
+
+def test_entries_with_other_fields_are_a_miss(tmp_path):
+    content = PreviewDiffContentType(id=42, diff_text="")
+    del content.diff_line_map
+    save_preview_diff_content(content, store_dir=str(tmp_path))
+    assert load_preview_diff_content(42, store_dir=str(tmp_path)) is None
+
+
+def test_entries_are_stored_per_format_version(tmp_path):
+    assert f"v{STORE_FORMAT_VERSION}" in get_preview_diff_store_path(42, store_dir=str(tmp_path))
@@ -0,0 +1,158 @@
+import random
+
+import pytest
+
+from launchpyd.lp_utils import (
+    CONTEXT_TRUNCATION_MARKER,
+    OMITTED_LINES_MARKER,
+    TRUNCATION_MARKER,
+    analyze_diff,
+    build_diff_line_map,
+    compact_line_map,
+    expand_line_map,
+    extract_file_and_line_from_diff,
+    extract_hunk_context_windows,
+    find_diff_shard_boundaries,
+    parse_base_diff_per_file_info,
+    parse_original_hunk_ranges,
+    truncate_file_contents,
+)
+
+
+def generate_diff(num_files: int, seed: int = 0) -> str:
+    """
+    Builds a diff mixing modified, new, deleted, binary and hunk-less file sections, with non-ascii file names and
+    lines that look like headers.
+    """
+    rng = random.Random(seed)
+    lines = ["preamble", "+not counted"]
+    for i in range(num_files):
+        name = f"dir/fïle{i}.py"
+        lines.append(f"diff --git a/{name} b/{name}")
+        kind = rng.choice(["modified", "new file", "deleted file", "binary", "mode change"])
+        if kind in ("new file", "deleted file"):
+            lines.append(f"{kind} mode 100644")
+        if kind == "mode change":
+            lines += ["old mode 100644", "new mode 100755"]
+            continue
+        lines.append("index 1234567..89abcde 100644")
+        if kind == "binary":
+            lines.append(f"Binary files a/{name} and b/{name} differ")
+            continue
+        lines += [f"--- a/{name}", f"+++ b/{name}"]
+        for _ in range(rng.randint(0, 3)):
+            lines.append(f"@@ -{rng.randint(0, 50)},3 +{rng.randint(0, 50)},4 @@ def x():")
+            for _ in range(rng.randint(1, 8)):
+                lines.append(rng.choice([" same", "+added", "-removed", "+++x", "---y", "", " diff --git in a line"]))
+    return "\n".join(lines) + "\n"
+
+
+class TestParseOriginalHunkRanges:
+    def test_parses_start_and_count(self):
+        snippet = "diff --git a/f b/f\n--- a/f\n+++ b/f\n@@ -3,4 +3,5 @@ def x():\n a\n@@ -20 +21 @@\n-b\n+c\n"
+        assert parse_original_hunk_ranges(snippet) == [(3, 4), (20, 1)]
+
+
+class TestExtractHunkContextWindows:
+    def test_keeps_whole_file_with_trailing_newline(self):
+        assert extract_hunk_context_windows("a\nb\nc\nd\n", [(1, 4)], 0) == "a\nb\nc\nd\n"
+
+    def test_trailing_newline_is_not_an_omitted_line(self):
+        assert extract_hunk_context_windows("a\nb\nc\nd\n", [(1, 2)], 1) == "a\nb\nc\n" + OMITTED_LINES_MARKER.format(
+            count=1
+        )
+
+    def test_without_trailing_newline(self):
+        assert extract_hunk_context_windows("a\nb\nc", [(3, 1)], 0) == OMITTED_LINES_MARKER.format(count=2) + "\nc"
+
+    def test_merges_overlapping_windows_and_marks_gaps(self):
+        contents = "".join(f"l{i}\n" for i in range(1, 21))
+        result = extract_hunk_context_windows(contents, [(5, 1), (7, 1), (15, 0)], 1)
+        assert result.split("\n") == [
+            OMITTED_LINES_MARKER.format(count=3),
+            "l4",
+            "l5",
+            "l6",
+            "l7",
+            "l8",
+            OMITTED_LINES_MARKER.format(count=5),
+            "l14",
+            "l15",
+            "l16",
+            OMITTED_LINES_MARKER.format(count=4),
+        ]
+
+    def test_empty_file(self):
+        assert extract_hunk_context_windows("", [], 3) == ""
+
+
+class TestTruncateFileContents:
+    def test_keeps_contents_within_limit(self):
+        assert truncate_file_contents("abc", 3, 3) == "abc"
+        assert truncate_file_contents("abc", 3, None) == "abc"
+
+    def test_truncates_with_marker(self):
+        assert truncate_file_contents("abcdef", 100, 3) == "abc\n" + TRUNCATION_MARKER.format(kept=3, size=100)
+
+    def test_custom_marker(self):
+        result = truncate_file_contents("abcdef", 6, 2, truncation_marker=CONTEXT_TRUNCATION_MARKER)
+        assert result == "ab\n" + CONTEXT_TRUNCATION_MARKER.format(kept=2, size=6)
+
+    def test_does_not_split_multibyte_characters(self):
+        assert truncate_file_contents("éé", 4, 3).startswith("é\n")
+
+
+class TestBuildDiffLineMap:
+    @pytest.mark.parametrize("seed", range(3))
+    def test_matches_extract_file_and_line_from_diff(self, seed):
+        diff_text = generate_diff(30, seed=seed)
+        line_map = build_diff_line_map(diff_text)
+        for line_number in range(len(diff_text.split("\n")) + 2):
+            file, relative_line, _ = extract_file_and_line_from_diff(line_number, diff_text)
+            assert line_map.get(line_number, (None, None)) == (file, relative_line)
+
+
+class TestFindDiffShardBoundaries:
+    def test_shards_start_at_file_sections_and_cover_all_lines(self):
+        diff_text = generate_diff(50)
+        boundaries = find_diff_shard_boundaries(diff_text, 8)
+        assert len(boundaries) > 1
+        assert boundaries[0][0] == 0
+        assert boundaries[-1][1] == len(diff_text)
+        for start, _ in boundaries[1:]:
+            assert diff_text[start:].startswith("diff --git a/")
+        assert "\n".join(diff_text[start:end] for start, end in boundaries) == diff_text
+
+
+class TestAnalyzeDiff:
+    @pytest.mark.parametrize("num_files", [0, 1, 3, 200])
+    @pytest.mark.parametrize("max_workers", [None, 2, 3])
+    def test_matches_serial_path(self, num_files, max_workers):
+        diff_text = generate_diff(num_files, seed=num_files)
+        expected = (parse_base_diff_per_file_info(diff_text), build_diff_line_map(diff_text))
+        assert analyze_diff(diff_text, max_workers=max_workers, min_sharded_size=0) == expected
+
+    def test_without_trailing_newline(self):
+        diff_text = generate_diff(100).rstrip("\n")
+        expected = (parse_base_diff_per_file_info(diff_text), build_diff_line_map(diff_text))
+        assert analyze_diff(diff_text, max_workers=2, min_sharded_size=0) == expected
+
+    def test_small_diff_does_not_use_the_pool(self, mocker):
+        get_executor = mocker.patch("launchpyd.lp_utils.get_diff_analysis_executor")
+        diff_text = generate_diff(50)
+        expected = (parse_base_diff_per_file_info(diff_text), build_diff_line_map(diff_text))
+        assert analyze_diff(diff_text, max_workers=2) == expected
+        get_executor.assert_not_called()
+
+
+class TestCompactLineMap:
+    def test_round_trip(self):
+        diff_text = generate_diff(30)
+        line_map = build_diff_line_map(diff_text)
+        runs, missing_line_nos = compact_line_map(line_map, 1, len(diff_text.split("\n")))
+        assert missing_line_nos
+        # one run per file section instead of one entry per line
+        assert len(runs) < len(line_map) / 10
+        expanded_line_map = {}
+        expand_line_map(runs, missing_line_nos, expanded_line_map)
+        assert expanded_line_map == line_map